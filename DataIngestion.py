@@ -5,6 +5,12 @@ import pandas as pd
 import sqlite3
 import os
 
+# SQLite's default cap on bound parameters per statement (SQLITE_MAX_VARIABLE_NUMBER)
+SQLITE_MAX_VARIABLES = 999
+
+# Columns whose distinct values populate the UI filter dropdowns
+UI_OPTION_COLUMNS = ['patient_id', 'left or right breast', 'image view']
+
 
 class DataIngestion:
     """
@@ -12,7 +18,13 @@ class DataIngestion:
     and ingesting the combined data into an SQLite database.
     """
 
-    def __init__(self):
+    def __init__(self, verify=False):
+        """
+        Args:
+            verify (bool): Read the written table back after patient_data_sql() as a sanity check.
+        """
+        self.verify = verify
+
          # 📝 Path Configuration: Use raw string for paths or better, a configuration file.
         base_dir = Path.home() / 'PycharmProjects/Apps/BreastCancer/Data/manifest-ZkhPvrLo5216730872708713142'
         self.data_path = base_dir
@@ -31,59 +43,65 @@ class DataIngestion:
         try:
             self.mass_data_train_df = pd.read_csv(self.mass_data_train_path)
             self.metadata_df = pd.read_csv(self.metadata_path)
+            self._build_location_map()
             print("Metadata CSV files loaded successfully.")
         except FileNotFoundError as e:
             print(f"Error: One or more CSV files not found. Check paths. Error: {e}")
         except Exception as e:
             print(f"Error reading CSV files: {e}")
 
-    def _get_full_dicom_path(self, row):
+    def _build_location_map(self):
         """
-        Helper method to generate the full DICOM paths for a single row.
-        Designed to be used with DataFrame.apply().
+        Builds a plain dict mapping each metadata 'Subject ID' to its full DICOM folder path.
+        Done once after loading, so linking paths is an O(1) lookup per row.
         """
-        # Extract folder names from the relative paths
-        image_folder_name = row['image file path'].split('/')[0]
-        mask_folder_name = row['ROI mask file path'].split('/')[0]
-
-        # 📝 Improvement: Use .loc for clean, conditional filtering
-        metadata_image_folder = self.metadata_df.loc[self.metadata_df['Subject ID'] == image_folder_name]
-        metadata_mask_folder = self.metadata_df.loc[self.metadata_df['Subject ID'] == mask_folder_name]
-
-        # Safely get the file location path (assuming only one match)
-        image_folder_path = metadata_image_folder['File Location'].iloc[0]
-        mask_folder_path = metadata_mask_folder['File Location'].iloc[0]
-
-        # Construct the final Path objects
-        images_path = self.data_path / image_folder_path
-        mask_path = self.data_path / mask_folder_path
-
-        return str(images_path), str(mask_path)
+        unique_locations = self.metadata_df.drop_duplicates('Subject ID')
+        self._location_map = {
+            subject_id: str(self.data_path / location)
+            for subject_id, location in zip(unique_locations['Subject ID'], unique_locations['File Location'])
+        }
+
+    @staticmethod
+    def _folder_name(relative_paths):
+        """
+        Vectorized helper that extracts the top-level folder name (the metadata 'Subject ID')
+        from a Series of relative file paths.
+        """
+        return relative_paths.str.split('/', n=1).str[0]
 
     def patient_data_df_with_dicom_paths(self):
         """
         Returns an updated version of the main patient table with the Windows local file
-        paths included, generated using the efficient .apply() method.
+        paths included, generated with a vectorized lookup against the metadata table.
         """
         # 📝 Improvement: Ensure mass_data_train_df exists before copying
         if not hasattr(self, 'mass_data_train_df'):
             print("Error: mass_data_train_df not loaded. Run patient_data_to_df() first.")
             return
 
+        if not hasattr(self, '_location_map'):
+            self._build_location_map()
+
         self.patient_data_df = self.mass_data_train_df.copy()
 
-        print("Linking DICOM file paths (using efficient .apply())...")
+        print("Linking DICOM file paths (using a vectorized metadata lookup)...")
+
+        image_keys = self._folder_name(self.patient_data_df['image file path'])
+        mask_keys = self._folder_name(self.patient_data_df['ROI mask file path'])
+
+        # 📝 Key Efficiency Improvement: Resolve every row with a dict lookup instead of
+        # scanning metadata_df twice per row.
+        self.patient_data_df["global image dicom path"] = image_keys.map(self._location_map)
+        self.patient_data_df["global mask dicom path"] = mask_keys.map(self._location_map)
 
-        # 📝 Key Efficiency Improvement: Use .apply() with a lambda function
-        # to process rows and assign new columns efficiently.
-        paths = self.patient_data_df.apply(
-            self._get_full_dicom_path,
-            axis=1,  # Apply function row-wise
-            result_type='expand'  # Expands the returned tuple into new columns
-        )
+        # 📝 Normalization: Store the filter columns in upper case so lookups can use plain,
+        # index-friendly equality instead of UPPER(column) = ?
+        for column_name in ['left or right breast', 'image view']:
+            self.patient_data_df[column_name] = self.patient_data_df[column_name].str.upper()
 
-        self.patient_data_df["global image dicom path"] = paths[0]
-        self.patient_data_df["global mask dicom path"] = paths[1]
+        unmatched = self.patient_data_df[["global image dicom path", "global mask dicom path"]].isna().any(axis=1)
+        if unmatched.any():
+            print(f"Warning: {unmatched.sum()} rows have no matching 'Subject ID' in the metadata file.")
 
         print("DICOM paths successfully added to DataFrame.")
 
@@ -115,14 +133,52 @@ class DataIngestion:
 
                 print(f"Attempting to write data to database: '{database_file_name}'...")
 
-                # 📝 Core Logic: Write DataFrame to SQL table
+                # 📝 Bulk Load: The table is fully regenerated from the CSV files on every run,
+                # so skip fsync and on-disk journaling while writing it.
+                conn.executescript(
+                    "PRAGMA journal_mode=MEMORY;"
+                    "PRAGMA synchronous=OFF;"
+                    "PRAGMA temp_store=MEMORY;"
+                    "PRAGMA cache_size=-200000;"
+                )
+
+                # 📝 Core Logic: Write DataFrame to SQL table. pandas runs all chunks inside a
+                # single transaction; 'multi' packs as many rows per INSERT as the parameter limit allows.
                 df.to_sql(
                     name=table_name,
                     con=conn,
                     if_exists='replace',  # 📝 Action: Replace the table if it exists
-                    index=False  # 📝 Best Practice: Do not write the pandas index as a column
+                    index=False,  # 📝 Best Practice: Do not write the pandas index as a column
+                    method='multi',
+                    chunksize=max(1, SQLITE_MAX_VARIABLES // len(df.columns))
                 )
 
+                # 📝 Index: The UI always filters by patient, breast side and image view
+                conn.execute(
+                    f'CREATE INDEX IF NOT EXISTS idx_{table_name}_pid_side_view '
+                    f'ON {table_name}(patient_id, "left or right breast", "image view")'
+                )
+
+                # 📝 Materialized Options: The distinct filter values only change when this table is
+                # regenerated, so compute them once here instead of on every app start.
+                conn.execute("DROP TABLE IF EXISTS ui_options")
+                conn.execute("CREATE TABLE ui_options (k TEXT, v)")
+                for column_name in UI_OPTION_COLUMNS:
+                    conn.execute(
+                        f'INSERT INTO ui_options SELECT DISTINCT ?, "{column_name}" FROM {table_name} '
+                        f'WHERE "{column_name}" IS NOT NULL',
+                        (column_name,)
+                    )
+                conn.execute("CREATE INDEX idx_ui_options_k ON ui_options(k)")
+
+                # 📝 Planner Statistics: Populate sqlite_stat1 so the new indexes are picked up
+                conn.execute("ANALYZE")
+
+                # 📝 Read Concurrency: WAL is persistent, so it is switched on here by the writer
+                # rather than by every read-only app connection (which would rewrite the file header)
+                conn.commit()
+                conn.execute("PRAGMA journal_mode=WAL")
+
                 self.database_exists = True
                 print(f"Success! DataFrame was written to table '{table_name}'.")
 
@@ -130,18 +186,20 @@ class DataIngestion:
             print(f"❌ An error occurred during database write: {e}")
             self.database_exists = False
 
-        # --- 3. (Optional) Verification Step ---
+        # --- 3. (Optional) Verification Step, only when requested ---
+        if not self.verify:
+            return
+
         print("\n--- Verifying: Reading data back from the DB ---")
         if self.database_exists:
             try:
                 # 📝 Use context manager for reading back as well
                 with sqlite3.connect(database_file_name) as conn:
 
-                    # 📝 Efficiency: Use LIMIT 5 to quickly verify data presence without loading the whole table
-                    df_from_db = pd.read_sql_query(f"SELECT * FROM {table_name} LIMIT 5", conn)
+                    # 📝 Efficiency: A row count confirms the write without materializing any rows
+                    row_count = conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
 
-                    print(f"Successfully read back 5 rows from table '{table_name}':")
-                    print(df_from_db)
+                    print(f"Successfully counted {row_count} rows in table '{table_name}' (expected {len(df)}).")
 
             except Exception as e:
                 print(f"❌ Could not read from database for verification: {e}")
@@ -1,72 +1,178 @@
 import sqlite3
 import pandas as pd
-from typing import List
+from typing import Dict, List, Optional
+
+# Size of sqlite3's per-connection cache of compiled statements (the default is 128)
+CACHED_STATEMENTS = 256
+
+# Low-cardinality text columns loaded as pandas categoricals, so filtering compares integer codes
+CATEGORICAL_COLUMNS = [
+    'patient_id', 'left or right breast', 'image view', 'pathology', 'mass shape', 'mass margins'
+]
+
+# Fixed statement texts, built once so every call hands sqlite3 the identical string and
+# reuses its compiled statement instead of re-parsing and re-planning the query
+COLUMN_NAMES_QUERY = "SELECT * FROM patients LIMIT 0"
+ALL_ROWS_QUERY = "SELECT * FROM patients"
+UI_OPTION_VALUES_QUERY = "SELECT v FROM ui_options WHERE k = ? ORDER BY v"
 
 class DatabaseHandler:
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: Optional[str] = None, connection: Optional[sqlite3.Connection] = None):
+        """
+        Either opens its own connection to 'db_path' on enter, or wraps an existing
+        'connection' owned by the caller, which is then left open on exit.
+        """
+        if db_path is None and connection is None:
+            raise ValueError("Either 'db_path' or 'connection' must be provided.")
         self.db_path = db_path
-        self.connection = None
+        self.connection = connection
+        self._owns_connection = connection is None
+        self._ui_option_columns = None
+        self._column_names = None
+        self._column_set = frozenset()
+        self._distinct_queries = {}
 
     def __enter__(self):
+        if not self._owns_connection:
+            return self
         try:
-            self.connection = sqlite3.connect(self.db_path)
+            self.connection = sqlite3.connect(self.db_path, cached_statements=CACHED_STATEMENTS)
             return self
         except sqlite3.Error as e:
             print(f"Error connecting to database: {e}")
             raise
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.connection:
+        if self._owns_connection and self.connection:
             self.connection.close()
 
     def get_column_names(self) -> List[str]:
-        """Fetches the column names from the 'patients' table."""
+        """Fetches the column names from the 'patients' table (queried once per handler)."""
         if not self.connection:
             raise ConnectionError("Database connection is not open.")
-        cursor = self.connection.cursor()
-        cursor.execute("SELECT * FROM patients LIMIT 0")
-        return [description[0] for description in cursor.description]
+        if self._column_names is None:
+            cursor = self.connection.cursor()
+            cursor.execute(COLUMN_NAMES_QUERY)
+            self._column_names = [description[0] for description in cursor.description]
+            self._column_set = frozenset(self._column_names)
+        return self._column_names
+
+    def _validate_columns(self, column_names: List[str]):
+        """
+        Raises ValueError for any name that is not a column of 'patients'. Column names are
+        quoted into SQL text, so only this whitelist of known columns may reach a query.
+        """
+        self.get_column_names()
+        for column_name in column_names:
+            if column_name not in self._column_set:
+                raise ValueError(f"Invalid column name: '{column_name}' does not exist in the table.")
 
     def get_distinct_values(self, column_name: str) -> List[str]:
-        """Fetches unique, non-null values from a specified column."""
+        """Fetches unique, non-null values from a specified column as a plain list, straight from the cursor rows."""
         if not self.connection:
             raise ConnectionError("Database connection is not open.")
-        
-        actual_columns = self.get_column_names()
-        if column_name not in actual_columns:
-            raise ValueError(f"Invalid column name: '{column_name}' does not exist in the table.")
+
+        if column_name in self._get_ui_option_columns():
+            cursor = self.connection.cursor()
+            return [row[0] for row in cursor.execute(UI_OPTION_VALUES_QUERY, (column_name,))]
+        return self.get_distinct_for(column_name)
+
+    def get_distinct_for(self, column_name: str, where_clause: Optional[str] = None, params: tuple = ()) -> List[str]:
+        """
+        Fetches the sorted unique, non-null values of a column, optionally restricted by a
+        parameterized WHERE condition (e.g. 'patient_id = ?'), so SQLite computes the distinct
+        set instead of pandas.
+        """
+        if not self.connection:
+            raise ConnectionError("Database connection is not open.")
+
+        self._validate_columns([column_name])
 
         cursor = self.connection.cursor()
-        cursor.execute(f'SELECT DISTINCT "{column_name}" FROM patients WHERE "{column_name}" IS NOT NULL ORDER BY "{column_name}"')
-        return [row[0] for row in cursor.fetchall()]
+        return [row[0] for row in cursor.execute(self._get_distinct_query(column_name, where_clause), params)]
+
+    def _get_distinct_query(self, column_name: str, where_clause: Optional[str] = None) -> str:
+        """
+        Returns the SELECT DISTINCT statement for a validated column and condition. The text is
+        built once per combination, so repeated calls hit sqlite3's compiled-statement cache.
+        """
+        key = (column_name, where_clause)
+        if key not in self._distinct_queries:
+            condition = f' AND ({where_clause})' if where_clause else ''
+            self._distinct_queries[key] = (
+                f'SELECT DISTINCT "{column_name}" FROM patients WHERE "{column_name}" IS NOT NULL{condition} '
+                f'ORDER BY "{column_name}"'
+            )
+        return self._distinct_queries[key]
 
-    def get_rows_by_patient_id(self, patient_id: str) -> pd.DataFrame:
-        """Fetches all rows for a given patient_id and returns them as a DataFrame."""
+    def get_distinct_values_by_column(self, column_names: List[str]) -> Dict[str, List[str]]:
+        """
+        Fetches unique, non-null values for several columns in a single query
+        (one UNION ALL statement instead of one round-trip per column).
+        """
         if not self.connection:
             raise ConnectionError("Database connection is not open.")
-        
-        query = "SELECT * FROM patients WHERE patient_id = ?"
-        df = pd.read_sql_query(query, self.connection, params=(patient_id,))
+
+        self._validate_columns(column_names)
+
+        values = {column_name: [] for column_name in column_names}
+        cursor = self.connection.cursor()
+
+        if set(column_names) <= self._get_ui_option_columns():
+            placeholders = ", ".join("?" for _ in column_names)
+            cursor.execute(f"SELECT k, v FROM ui_options WHERE k IN ({placeholders}) ORDER BY k, v", column_names)
+            for column_name, value in cursor:
+                values[column_name].append(value)
+            return values
+
+        # Each branch is tagged with the column's position, so no column name needs escaping as a literal
+        query = " UNION ALL ".join(
+            f'SELECT {position} AS k, v FROM (SELECT DISTINCT "{column_name}" AS v FROM patients WHERE "{column_name}" IS NOT NULL)'
+            for position, column_name in enumerate(column_names)
+        ) + " ORDER BY k, v"
+
+        for position, value in cursor.execute(query):
+            values[column_names[position]].append(value)
+        return values
+
+    def _get_ui_option_columns(self) -> set:
+        """
+        Returns the columns whose distinct values were materialized into the 'ui_options'
+        table at ingest. Databases written before that table existed fall back to scanning 'patients'.
+        """
+        if self._ui_option_columns is None:
+            cursor = self.connection.cursor()
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'ui_options'")
+            if cursor.fetchone() is None:
+                self._ui_option_columns = set()
+            else:
+                cursor.execute("SELECT DISTINCT k FROM ui_options")
+                self._ui_option_columns = {row[0] for row in cursor.fetchall()}
+        return self._ui_option_columns
+
+    def get_all_rows(self) -> pd.DataFrame:
+        """Fetches the whole 'patients' table as a DataFrame, for callers that keep it in memory."""
+        if not self.connection:
+            raise ConnectionError("Database connection is not open.")
+
+        df = self._query_to_df(ALL_ROWS_QUERY, ())
+        for column_name in CATEGORICAL_COLUMNS:
+            if column_name in df.columns:
+                df[column_name] = df[column_name].astype('category')
         return df
 
-    def filter_by_breast_side(self, df: pd.DataFrame, side: str) -> pd.DataFrame:
-        """Filters a DataFrame based on the 'left or right breast' column."""
-        if df.empty or 'left or right breast' not in df.columns:
-            return pd.DataFrame()
-        
-        side_upper = side.upper()
-        return df[df['left or right breast'].str.upper() == side_upper].copy()
-
-    def filter_by_image_view(self, df: pd.DataFrame, image_view: str) -> pd.DataFrame:
-        """Filters a DataFrame based on the 'image view' column."""
-        if df.empty or 'image view' not in df.columns:
-            return pd.DataFrame()
-            
-        image_view_upper = image_view.upper()
-        return df[df['image view'].str.upper() == image_view_upper].copy()
-
-    def get_dicom_paths(self, df: pd.DataFrame) -> List[str]:
-        """Extracts the 'global image dicom path' from a DataFrame."""
+    def _query_to_df(self, query: str, params: tuple) -> pd.DataFrame:
+        """
+        Runs a query and builds the DataFrame straight from the fetched tuples, skipping the
+        extra conversion layers of pd.read_sql_query that dominate for these small result sets.
+        """
+        cursor = self.connection.execute(query, params)
+        columns = [description[0] for description in cursor.description]
+        return pd.DataFrame.from_records(cursor.fetchall(), columns=columns)
+
+    @staticmethod
+    def get_dicom_paths(df: pd.DataFrame) -> List[str]:
+        """Extracts the 'global image dicom path' from a DataFrame. Pure pandas, needs no open connection."""
         if df.empty or 'global image dicom path' not in df.columns:
             return []
         
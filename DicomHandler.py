@@ -5,6 +5,24 @@ import os
 from pathlib import Path
 import matplotlib.pyplot as plt
 
+# A DICOM Part 10 file starts with a 128-byte preamble followed by the 'DICM' prefix
+DICOM_PREAMBLE_LENGTH = 128
+DICOM_PREFIX = b'DICM'
+
+PIXEL_DATA_TAG = 0x7FE00010
+UNDEFINED_LENGTH = 0xFFFFFFFF
+# Transfer syntaxes whose pixel data is stored as-is and can be mapped straight from the file
+UNCOMPRESSED_LITTLE_ENDIAN = {pydicom.uid.ImplicitVRLittleEndian, pydicom.uid.ExplicitVRLittleEndian}
+
+# Patient and series metadata reported by get_metadata, resolved to numeric tags once at import
+METADATA_KEYWORDS = [
+    'PatientName', 'PatientID', 'PatientBirthDate', 'PatientSex', 'PatientAge',
+    'StudyInstanceUID', 'SeriesInstanceUID', 'SOPInstanceUID', 'StudyID',
+    'SeriesNumber', 'AcquisitionDate', 'StudyDescription', 'SeriesDescription',
+    'Modality', 'Manufacturer', 'Rows', 'Columns', 'PixelSpacing'
+]
+METADATA_TAGS = [(keyword, pydicom.datadict.tag_for_keyword(keyword)) for keyword in METADATA_KEYWORDS]
+
 
 class DicomHandler:
     """
@@ -13,68 +31,163 @@ class DicomHandler:
     operations on clinical database and/or user interactions with the business logic. Clinical database should have the
     patient related path to the DICOM files and provide them to this class"""
 
-    def __init__(self, folder_path):
+    def __init__(self, folder_path, allow_headerless=False, header_only=False):
         """
         Initializes the handler by finding and reading the first DICOM file in a folder.
 
         Args:
             folder_path (str or Path): The path to the folder containing DICOM files.
+            allow_headerless (bool): Also accept '.dcm' files written without the preamble
+                                     and 'DICM' prefix. These need a (slower) pydicom probe.
+            header_only (bool): Stop reading at the pixel data, for callers that only need
+                                metadata. get_pixel_array() then returns None.
         """
         self.folder_path = Path(folder_path)
-        self.dicom_path = self._find_first_dicom_file()
+        self.allow_headerless = allow_headerless
+        self.header_only = header_only
+        self.dicom_path = self.find_first_dicom_file(self.folder_path, self.allow_headerless)
         self.dataset = None
 
         if self.dicom_path:
             try:
-                self.dataset = pydicom.dcmread(self.dicom_path)
+                # Large elements (e.g. pixel data, private tags) stay on disk until accessed
+                self.dataset = pydicom.dcmread(
+                    self.dicom_path, defer_size='1 KB', force=self.allow_headerless,
+                    stop_before_pixels=self.header_only
+                )
                 print(f"DicomHandler initialized for: {self.dicom_path.name}")
             except Exception as e:
                 print(f"Error reading DICOM file at {self.dicom_path}: {e}")
         else:
             print(f"No valid DICOM files found in '{self.folder_path}'.")
 
-    def _find_first_dicom_file(self):
+    @staticmethod
+    def find_first_dicom_file(folder_path, allow_headerless=False):
         """
-        Finds the first valid DICOM file in the specified folder path.
+        Finds the first valid DICOM file in the specified folder path, the file a DicomHandler
+        for that folder reads.
+
+        Files are identified by their 'DICM' prefix, which only requires reading 132 bytes
+        per file instead of parsing the whole header with pydicom.
 
         Returns:
             Path object or None: The path to the first DICOM file, or None if not found.
         """
-        if not self.folder_path.is_dir():
-            print(f"Error: Provided path '{self.folder_path}' is not a directory.")
+        folder_path = Path(folder_path)
+        if not folder_path.is_dir():
+            print(f"Error: Provided path '{folder_path}' is not a directory.")
             return None
 
-        for file_path in self.folder_path.iterdir():
-            if file_path.is_file():
-                try:
-                    # Try to read the file header to confirm it's a DICOM file
-                    pydicom.dcmread(file_path, stop_before_pixels=True)
-                    print(f"Found DICOM file: {file_path.name}")
-                    return file_path  # Return the path of the first valid file
-                except pydicom.errors.InvalidDicomError:
-                    continue  # Not a DICOM file, ignore
+        # Check '.dcm' files first, they are by far the most likely candidates
+        candidates = sorted(
+            (file_path for file_path in folder_path.iterdir() if file_path.is_file()),
+            key=lambda file_path: file_path.suffix.lower() != '.dcm'
+        )
+
+        for file_path in candidates:
+            if DicomHandler._has_dicom_prefix(file_path):
+                print(f"Found DICOM file: {file_path.name}")
+                return file_path  # Return the path of the first valid file
+
+        if allow_headerless:
+            for file_path in candidates:
+                if file_path.suffix.lower() == '.dcm' and DicomHandler._is_headerless_dicom(file_path):
+                    print(f"Found DICOM file without preamble: {file_path.name}")
+                    return file_path
 
         return None  # No DICOM files were found
 
+    @staticmethod
+    def _has_dicom_prefix(file_path):
+        """
+        Checks for the 'DICM' prefix that follows the 128-byte preamble of a DICOM file.
+        """
+        try:
+            with open(file_path, 'rb') as f:
+                f.seek(DICOM_PREAMBLE_LENGTH)
+                return f.read(len(DICOM_PREFIX)) == DICOM_PREFIX
+        except OSError:
+            return False
+
+    @staticmethod
+    def _is_headerless_dicom(file_path):
+        """
+        Probes a file without preamble with pydicom, reading only the SOPInstanceUID tag.
+        """
+        try:
+            dataset = pydicom.dcmread(
+                file_path, stop_before_pixels=True, defer_size='1 KB',
+                specific_tags=['SOPInstanceUID'], force=True
+            )
+            return 'SOPInstanceUID' in dataset
+        except Exception:
+            return False  # Not a DICOM file, ignore
+
     # ----------------------------------------------------------------------
     # 1. Function to return the pixel data as a numpy array
     # ----------------------------------------------------------------------
     def get_pixel_array(self):
         """
         Returns the raw image pixel data as a NumPy array from the loaded DICOM file.
+
+        Uncompressed little-endian images are returned as a read-only memory map of the file,
+        so no copy of the pixel data is made; other transfer syntaxes are decoded by pydicom.
         """
         if self.dataset is None:
             print("Cannot get pixel array: No DICOM dataset loaded.")
             return None
+        if self.header_only:
+            print("Cannot get pixel array: Only the DICOM header was read.")
+            return None
 
         try:
-            pixel_data = self.dataset.pixel_array
+            pixel_data = self._memmap_pixel_array()
+            if pixel_data is None:
+                pixel_data = self.dataset.pixel_array
             print(f"Pixel data extracted successfully. Shape: {pixel_data.shape}")
             return pixel_data
         except Exception as e:
             print(f"Error extracting pixel data: {e}")
             return None
 
+    def _memmap_pixel_array(self):
+        """
+        Maps the pixel data of a single-frame, uncompressed little-endian image directly from the file.
+
+        Returns:
+            np.memmap or None: The (Rows, Columns) pixel array, or None if the file layout
+                               is not supported and pydicom has to decode the pixel data.
+        """
+        dataset = self.dataset
+        transfer_syntax = getattr(getattr(dataset, 'file_meta', None), 'TransferSyntaxUID', None)
+        if transfer_syntax not in UNCOMPRESSED_LITTLE_ENDIAN:
+            return None
+
+        bits_allocated = dataset.get('BitsAllocated')
+        is_signed = dataset.get('PixelRepresentation', 0) == 1
+        if (bits_allocated not in (8, 16)
+                or dataset.get('SamplesPerPixel', 1) != 1
+                or int(dataset.get('NumberOfFrames', 1) or 1) != 1
+                # With unused high bits pydicom masks (unsigned) or sign-extends (signed) the
+                # values, a raw map would not
+                or dataset.get('BitsStored', bits_allocated) != bits_allocated):
+            return None
+
+        try:
+            # pydicom >= 3 converts deferred elements on access unless told to keep them raw
+            element = dataset.get_item(PIXEL_DATA_TAG, keep_deferred=True)
+        except TypeError:
+            element = dataset.get_item(PIXEL_DATA_TAG)
+
+        offset = getattr(element, 'value_tell', None)
+        length = getattr(element, 'length', None)
+        dtype = np.dtype(f"<{'i' if is_signed else 'u'}{bits_allocated // 8}")
+        shape = (int(dataset.Rows), int(dataset.Columns))
+        if offset is None or length is None or length == UNDEFINED_LENGTH or length < shape[0] * shape[1] * dtype.itemsize:
+            return None
+
+        return np.memmap(self.dicom_path, dtype=dtype, mode='r', offset=offset, shape=shape)
+
     # ----------------------------------------------------------------------
     # 2. Function to return patient metadata
     # ----------------------------------------------------------------------
@@ -87,23 +200,31 @@ class DicomHandler:
             return {}
 
         metadata = {}
-        tags_to_extract = [
-            'PatientName', 'PatientID', 'PatientBirthDate', 'PatientSex', 'PatientAge',
-            'StudyInstanceUID', 'SeriesInstanceUID', 'SOPInstanceUID', 'StudyID',
-            'SeriesNumber', 'AcquisitionDate', 'StudyDescription', 'SeriesDescription',
-            'Modality', 'Manufacturer', 'Rows', 'Columns', 'PixelSpacing'
-        ]
-
-        for tag in tags_to_extract:
-            try:
-                data_element = self.dataset[tag]
-                metadata[tag] = str(data_element.value)
-            except (KeyError, AttributeError):
-                metadata[tag] = 'N/A'
+        for keyword, tag in METADATA_TAGS:
+            # Numeric tag lookup skips pydicom's keyword -> tag resolution on every access
+            data_element = self.dataset.get(tag)
+            metadata[keyword] = 'N/A' if data_element is None else str(data_element.value)
 
         print("Metadata extracted successfully.")
         return metadata
 
+    # ----------------------------------------------------------------------
+    # 3. Function to return the pixel spacing
+    # ----------------------------------------------------------------------
+    def get_pixel_spacing(self):
+        """
+        Returns the (row, column) pixel spacing in mm as a list of two floats, or None if the
+        loaded DICOM file does not define it.
+        """
+        if self.dataset is None:
+            print("Cannot get pixel spacing: No DICOM dataset loaded.")
+            return None
+
+        pixel_spacing = self.dataset.get('PixelSpacing')
+        if pixel_spacing is None or len(pixel_spacing) != 2:
+            return None
+        return [float(value) for value in pixel_spacing]
+
 
 if __name__ == '__main__':
     # This path now points to the FOLDER containing the DICOM file(s)
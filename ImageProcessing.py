@@ -1,6 +1,31 @@
 import numpy as np
 from PIL import Image
-from typing import Optional
+from functools import lru_cache
+from typing import Optional, Tuple
+
+@lru_cache(maxsize=32)
+def _normalization_lut(dtype_str: str, min_val: int, max_val: int) -> Tuple[np.ndarray, np.dtype]:
+    """
+    Builds the uint8 lookup table that rescales an 8/16-bit integer dtype from [min_val, max_val]
+    to 0-255, plus the unsigned dtype that indexes it. Cached per (dtype, min, max), so repeated
+    renders of images with the same range reuse the table. The table is read-only, as it is shared.
+    """
+    pixel_dtype = np.dtype(dtype_str)
+    index_dtype = np.dtype(dtype_str.replace('i', 'u'))
+    if pixel_dtype == index_dtype:
+        stored_values = np.arange(max_val + 1, dtype=np.int64)
+    else:
+        stored_values = np.arange(np.iinfo(index_dtype).max + 1, dtype=index_dtype)
+        stored_values = stored_values.view(pixel_dtype).astype(np.int64)
+    span = max_val - min_val
+    stored_values -= min_val
+    np.clip(stored_values, 0, span, out=stored_values)
+    stored_values *= 255
+    stored_values //= span
+    lut = stored_values.astype(np.uint8)
+    lut.setflags(write=False)
+    return lut, index_dtype
+
 
 class ImageProcessing:
     """
@@ -26,16 +51,32 @@ class ImageProcessing:
             return None
 
         try:
-            pixel_array_float = pixel_array.astype(float)
-            min_val = pixel_array_float.min()
-            max_val = pixel_array_float.max()
+            if pixel_array.dtype == np.bool_:
+                # Masks are rescaled like 0/1 uint8 data, numpy cannot subtract booleans
+                pixel_array = pixel_array.view(np.uint8)
 
-            if max_val > min_val:
-                # Normalize to 0-1 range, then scale to 0-255
-                normalized_pixels = (pixel_array_float - min_val) / (max_val - min_val) * 255.0
-            else:
+            min_val = pixel_array.min()
+            max_val = pixel_array.max()
+
+            if max_val <= min_val:
                 # Handle the case of a solid color image
-                normalized_pixels = np.zeros(pixel_array.shape)
+                return Image.fromarray(np.zeros(pixel_array.shape, dtype=np.uint8))
+
+            if np.issubdtype(pixel_array.dtype, np.integer) and pixel_array.dtype.itemsize <= 2:
+                # Lookup-table rescale for 8/16-bit data: every possible stored value is mapped to
+                # its 8-bit output once, and the image is read once by the lookup. The table is
+                # indexed by the unsigned view of the pixels, so signed data needs no offset pass.
+                lut, index_dtype = _normalization_lut(pixel_array.dtype.str, int(min_val), int(max_val))
+                return Image.fromarray(np.take(lut, pixel_array.view(index_dtype)))
+            else:
+                # Shift and scale to 0-255 in place in a single float32 buffer; 8-bit output does
+                # not need float64 precision, and float32 halves the bytes moved per pass. The
+                # subtraction runs in the input's own precision and only its result is written as
+                # float32, so offset data (large values, small range) keeps its detail.
+                normalized_pixels = np.empty(pixel_array.shape, dtype=np.float32)
+                np.subtract(pixel_array, min_val, out=normalized_pixels, casting='same_kind')
+                normalized_pixels *= np.float32(255.0 / (float(max_val) - float(min_val)))
+                np.clip(normalized_pixels, 0, 255, out=normalized_pixels)
 
             # Convert to an 8-bit unsigned integer array and then to a PIL Image
             final_image = Image.fromarray(normalized_pixels.astype(np.uint8))
@@ -1,8 +1,81 @@
 import DatabaseHandler
 import DicomHandler
+import sqlite3
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
 import pandas as pd
-from typing import Dict, List, Any, Tuple, Optional
+from typing import Dict, List, Any, Tuple, Optional, NamedTuple
+
+
+# Clinical columns shown to the user; identifiers, filter columns and file paths are left out
+PRESENTATION_COLUMNS = (
+    'breast_density', 'abnormality id', 'abnormality type', 'mass shape',
+    'mass margins', 'assessment', 'pathology', 'subtlety'
+)
+# Columns that identify a UI selection, in (patient_id, breast_side, image_view) order
+SELECTION_COLUMNS = ('patient_id', 'left or right breast', 'image view')
+DICOM_PATH_COLUMN = 'global image dicom path'
+
+
+
+class PatientSelection(NamedTuple):
+    """The clinical record and DICOM path shown for one (patient_id, breast_side, image_view) selection."""
+    record: Dict[str, Any]
+    dicom_path: Optional[str]
+
+
+@lru_cache(maxsize=256)
+def _find_dicom_file(path_str: str) -> Path:
+    """
+    Resolves a DICOM folder to the file a DicomHandler reads from it, cached by folder so the
+    folder is only scanned once. A folder without a DICOM file raises, so it is never cached.
+    """
+    dicom_file = DicomHandler.DicomHandler.find_first_dicom_file(Path(path_str))
+    if dicom_file is None:
+        raise FileNotFoundError(f"No DICOM file found in {path_str}")
+    return dicom_file
+
+
+def _dicom_mtime_ns(path_str: str) -> int:
+    """
+    Returns the modification time of the DICOM file of a folder. The folder's own mtime does
+    not change when the file is rewritten in place, so the file is stat'ed.
+    """
+    try:
+        return _find_dicom_file(path_str).stat().st_mtime_ns
+    except OSError:
+        # The resolved file was removed or renamed, look for it again
+        _find_dicom_file.cache_clear()
+        return _find_dicom_file(path_str).stat().st_mtime_ns
+
+
+@lru_cache(maxsize=8)
+def _load_dicom(path_str: str, mtime_ns: int) -> DicomHandler.DicomHandler:
+    """
+    Returns a DicomHandler for a DICOM folder, cached by path and file mtime so repeated UI clicks
+    on the same image do not re-read the file, while a rewritten file is loaded again. Use
+    _load_dicom.cache_clear() to invalidate. Failed loads raise, so they are never cached.
+    """
+    dcmh = DicomHandler.DicomHandler(Path(path_str))
+    if dcmh.dataset is None:
+        raise FileNotFoundError(f"Failed to load DICOM data from {path_str}")
+    return dcmh
+
+
+@lru_cache(maxsize=32)
+def _load_dicom_header(path_str: str, mtime_ns: int) -> DicomHandler.DicomHandler:
+    """
+    Returns a DicomHandler that read only the header of a DICOM folder's file, cached by path and
+    file mtime. Used for metadata so the pixel data is never read. Failed loads raise, so they are
+    never cached.
+    """
+    dcmh = DicomHandler.DicomHandler(Path(path_str), header_only=True)
+    if dcmh.dataset is None:
+        raise FileNotFoundError(f"Failed to load DICOM header from {path_str}")
+    return dcmh
+
 
 class PatientDataFilterLogic:
     """
@@ -12,109 +85,193 @@ class PatientDataFilterLogic:
 
     def __init__(self, clinical_database_path: str):
         self.db_path = clinical_database_path
+        self._conn = self._open_connection()
+        self._dbh = DatabaseHandler.DatabaseHandler(connection=self._conn)
+        # Streamlit runs sessions on separate threads; they take turns on the shared connection
+        self._lock = threading.RLock()
+        self._option_index = None
+        # The table is small and read-only at runtime, so it is kept in memory and the
+        # record / DICOM path lookups are answered without touching SQLite.
+        self._patients_df = None
+        self._record_index = None
+        self._load_patients()
 
-    def _get_full_filtered_data(self, patient_id: str, breast_side: str, image_view: str) -> pd.DataFrame:
+    def _open_connection(self) -> sqlite3.Connection:
         """
-        Private helper method to get the complete filtered DataFrame.
+        Opens the long-lived, read-only connection shared by every query of this instance,
+        so UI interactions do not pay a connect/close per query.
         """
-        with DatabaseHandler.DatabaseHandler(self.db_path) as dbh:
-            patient_df = dbh.get_rows_by_patient_id(patient_id)
-            side_filtered_df = dbh.filter_by_breast_side(patient_df, breast_side)
-            final_filtered_df = dbh.filter_by_image_view(side_filtered_df, image_view)
-        return final_filtered_df
+        conn = sqlite3.connect(
+            self.db_path, check_same_thread=False, cached_statements=DatabaseHandler.CACHED_STATEMENTS
+        )
+        conn.execute("PRAGMA cache_size=-20000")  # ~20 MB page cache, kept warm across queries
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA query_only=1")
+        return conn
 
-    def get_all_patient_ids(self) -> List[str]:
-        """Fetches a list of all unique patient IDs."""
-        try:
-            with DatabaseHandler.DatabaseHandler(self.db_path) as dbh:
-                return dbh.get_distinct_values('patient_id')
-        except Exception as e:
-            print(f"Error fetching patient IDs: {e}")
-            return []
+    @contextmanager
+    def _db(self):
+        """
+        Yields the DatabaseHandler bound to the shared connection (reused so its lookups stay
+        cached), holding the lock so only one thread uses the connection at a time.
+        """
+        with self._lock, self._dbh as dbh:
+            yield dbh
 
-    def get_dependent_options(self, patient_id: str, breast_side: Optional[str] = None) -> Dict[str, List[str]]:
+    def _load_patients(self):
         """
-        Gets the available filter options based on prior selections.
+        Loads the 'patients' table into memory once and indexes the first row of every
+        (patient_id, breast_side, image_view) selection as a {column: value} dict.
+        """
+        with self._db() as dbh:
+            patients_df = dbh.get_all_rows()
+
+        # Side and view are matched case-insensitively: store them upper-cased, as the lookups
+        # upper-case their arguments. Databases from older ingests may hold mixed case.
+        for column_name in ('left or right breast', 'image view'):
+            patients_df[column_name] = patients_df[column_name].astype(object).str.upper().astype('category')
+
+        first_rows = patients_df.drop_duplicates(list(SELECTION_COLUMNS))
+        record_columns = list(PRESENTATION_COLUMNS) + [DICOM_PATH_COLUMN]
+        # Missing values become None, as they would coming straight from SQLite
+        records = first_rows[record_columns].astype(object)
+        records = records.where(records.notna(), None).to_dict('records')
+        keys = zip(*(first_rows[column].astype(object) for column in SELECTION_COLUMNS))
+
+        self._patients_df = patients_df
+        self._record_index = dict(zip(keys, records))
+
+    def close(self):
+        """Closes the shared database connection."""
+        self._conn.close()
+
+    def get_ui_selection_options(self) -> Dict[str, List[str]]:
+        """
+        Gets the sorted unique patient IDs, breast sides and image views from the in-memory table,
+        the same source as the option index, so the sidebar never lists values without data.
+        """
+        patients_df = self._patients_df
+        return {
+            option_name: sorted(patients_df[column_name].dropna().astype(object).unique())
+            for option_name, column_name in zip(('patient_ids', 'breast_sides', 'image_views'), SELECTION_COLUMNS)
+        }
+
+    def build_option_index(self) -> Dict[str, Dict[str, List[str]]]:
+        """
+        Collects every (patient, breast side, image view) combination of the in-memory table and
+        nests them as {patient_id: {breast_side: [image_views]}}. Built once per instance, so the
+        dependent dropdowns are plain dict lookups afterwards. Sides and views are upper case,
+        matching the lookups.
+        """
+        if self._option_index is None:
+            combinations = (
+                self._patients_df[list(SELECTION_COLUMNS)].astype(object)
+                .drop_duplicates().dropna().sort_values(list(SELECTION_COLUMNS))
+            )
+
+            option_index = {}
+            for patient_id, breast_side, image_view in combinations.itertuples(index=False, name=None):
+                option_index.setdefault(patient_id, {}).setdefault(breast_side, []).append(image_view)
+            self._option_index = option_index
+        return self._option_index
+
+    def get_patient_option_tree(self, patient_id: str) -> Dict[str, List[str]]:
+        """
+        Gets every breast side of a patient with its image views as {breast_side: [image_views]},
+        so the UI can fill both dependent dropdowns from one lookup.
         """
-        options = {'breast_sides': [], 'image_views': []}
         if not patient_id:
-            return options
-        
+            return {}
+
         try:
-            with DatabaseHandler.DatabaseHandler(self.db_path) as dbh:
-                patient_df = dbh.get_rows_by_patient_id(patient_id)
-                if patient_df.empty:
-                    return options
-
-                if breast_side:
-                    side_df = dbh.filter_by_breast_side(patient_df, breast_side)
-                    options['breast_sides'] = patient_df['left or right breast'].unique().tolist()
-                    options['image_views'] = side_df['image view'].unique().tolist()
-                else:
-                    options['breast_sides'] = patient_df['left or right breast'].unique().tolist()
-                    options['image_views'] = patient_df['image view'].unique().tolist()
-            
-            return options
+            side_to_views = self.build_option_index().get(patient_id, {})
+            # The index is shared between calls, hand out copies
+            return {breast_side: list(views) for breast_side, views in side_to_views.items()}
         except Exception as e:
-            print(f"Error fetching dependent options: {e}")
-            return options
+            print(f"Error fetching patient option tree: {e}")
+            return {}
 
-    def get_patient_filtered_data(self, patient_id: str, breast_side: str, image_view: str) -> pd.DataFrame:
+    def get_patient_filtered_data_batch(self, selections: List[Tuple[str, str, str]]) -> pd.DataFrame:
         """
-        Gets filtered clinical data, removes redundant columns, and returns it for presentation.
+        Gets the presentation data of several (patient_id, breast_side, image_view) selections in
+        one pass over the in-memory table. The selection columns are kept so callers can group by them.
         """
-        final_filtered_df = self._get_full_filtered_data(patient_id, breast_side, image_view)
-        columns_to_drop = [
-            'patient_id', 'left or right breast', 'image view',
-            'image file path', 'cropped image file path', 'ROI mask file path',
-            'global image dicom path', 'global mask dicom path'
+        df = self._patients_df
+        output_columns = list(SELECTION_COLUMNS) + list(PRESENTATION_COLUMNS)
+        keys = [
+            (patient_id, breast_side.upper(), image_view.upper()) for patient_id, breast_side, image_view in selections
         ]
-        return final_filtered_df.drop(columns=columns_to_drop, errors='ignore')
+        rows = pd.MultiIndex.from_arrays([df[column].astype(object) for column in SELECTION_COLUMNS])
+        return df.loc[rows.isin(keys), output_columns].reset_index(drop=True)
+
+    def _get_first_record(self, patient_id: str, breast_side: str, image_view: str) -> Optional[Dict[str, Any]]:
+        """
+        Private helper that looks up the first row of a selection in the in-memory record index.
+        """
+        return self._record_index.get((patient_id, breast_side.upper(), image_view.upper()))
+
+    def get_patient_selection(self, patient_id: str, breast_side: str, image_view: str) -> Optional[PatientSelection]:
+        """
+        Gets everything the UI shows for a selection, the clinical record and the DICOM path, with
+        a single record index lookup. Returns None if nothing matches.
+        """
+        record = self._get_first_record(patient_id, breast_side, image_view)
+        if not record:
+            return None
+        return PatientSelection(
+            record={column: record[column] for column in PRESENTATION_COLUMNS},
+            dicom_path=record[DICOM_PATH_COLUMN]
+        )
+
+    def get_dicom_path_scalar(self, patient_id: str, breast_side: str, image_view: str) -> Optional[Path]:
+        """
+        Answers "is there data, and where is its DICOM" with one record index lookup: returns the
+        DICOM path of the first record matching the filters, or None. No DataFrame is built.
+        """
+        record = self._get_first_record(patient_id, breast_side, image_view)
+        dicom_path = record[DICOM_PATH_COLUMN] if record else None
+        return Path(dicom_path) if dicom_path else None
 
-    def get_patient_dicom_path(self, patient_id: str, breast_side: str, image_view: str) -> Path:
+    def get_dicom_mtime_ns(self, dcm_path: Path) -> int:
         """
-        Retrieves the DICOM path by re-filtering the data internally.
+        Returns the modification time of the DICOM file in a DICOM folder, for callers that key
+        their own caches on it. Raises FileNotFoundError if the folder holds no DICOM file.
         """
-        final_filtered_df = self._get_full_filtered_data(patient_id, breast_side, image_view)
-        with DatabaseHandler.DatabaseHandler(self.db_path) as dbh:
-            dicom_paths = dbh.get_dicom_paths(final_filtered_df)
-            if not dicom_paths:
-                raise FileNotFoundError("No DICOM path found for the specified filters.")
-            return Path(dicom_paths[0])
+        return _dicom_mtime_ns(str(dcm_path))
 
-    def get_patient_image_data(self, dcm_path: Path) -> Tuple[Any, Dict]:
+    def get_patient_image_data(self, dcm_path: Path) -> Any:
         """
-        Retrieves the raw pixel array and metadata from a DICOM file path.
+        Retrieves the raw pixel array from a DICOM file path. Use get_dicom_metadata for the metadata.
         """
-        dcmh = DicomHandler.DicomHandler(dcm_path)
-        if dcmh.dataset is None:
-            raise FileNotFoundError(f"Failed to load DICOM data from {dcm_path}")
-        
-        pixel_array = dcmh.get_pixel_array()
-        image_metadata = dcmh.get_metadata()
-        
-        return pixel_array, image_metadata
+        dcmh = _load_dicom(str(dcm_path), _dicom_mtime_ns(str(dcm_path)))
+        return dcmh.get_pixel_array()
+
+    def get_dicom_metadata(self, dcm_path: Path) -> Tuple[Dict, Optional[List[float]]]:
+        """
+        Retrieves the metadata and pixel spacing of a DICOM file path from a header-only read,
+        so the pixel data is neither read nor decoded.
+        """
+        dcmh = _load_dicom_header(str(dcm_path), _dicom_mtime_ns(str(dcm_path)))
+        return dcmh.get_metadata(), dcmh.get_pixel_spacing()
 
 if __name__ == '__main__':
-    pdfl = PatientDataFilterLogic("clinical_database.db")
-    
-    def check_distinct(column_name):
-        try:
-            with DatabaseHandler.DatabaseHandler(pdfl.db_path) as dbh:
-                values = dbh.get_distinct_values(column_name)
-                # Sort numeric values correctly
-                try:
-                    sorted_values = sorted(values, key=int)
-                except ValueError:
-                    sorted_values = sorted(values)
-                print(f"Unique values for '{column_name}': {sorted_values}")
-        except Exception as e:
-            print(f"Error checking '{column_name}': {e}")
+    # The diagnostics only need the distinct values, so a plain DatabaseHandler is enough;
+    # the in-memory table of PatientDataFilterLogic is not loaded.
+    tooltip_columns = ['pathology', 'breast_density', 'mass shape', 'mass margins', 'subtlety']
 
     print("--- Investigating Unique Values for Tooltips ---")
-    check_distinct('pathology')
-    check_distinct('breast_density')
-    check_distinct('mass shape')
-    check_distinct('mass margins')
-    check_distinct('subtlety')
+    try:
+        with DatabaseHandler.DatabaseHandler("clinical_database.db") as dbh:
+            distinct_values = dbh.get_distinct_values_by_column(tooltip_columns)
+    except Exception as e:
+        print(f"Error checking tooltip columns: {e}")
+        distinct_values = {}
+
+    for column_name, values in distinct_values.items():
+        # Sort numeric values correctly
+        try:
+            sorted_values = sorted(values, key=int)
+        except ValueError:
+            sorted_values = sorted(values)
+        print(f"Unique values for '{column_name}': {sorted_values}")
     print("--- Investigation Complete ---")
@@ -4,6 +4,9 @@ import numpy as np
 import pandas as pd
 import sqlite3
 
+# Filter columns whose distinct values are materialized into the 'ui_options' table
+UI_OPTION_COLUMNS = ['patient_id', 'left or right breast', 'image view']
+
 class DataIngestion:
 
 
@@ -19,22 +22,29 @@ class DataIngestion:
         """Reads csv files including pataient and metadata and converts them to a pandas dataframe"""
         self.mass_data_train_df = pd.read_csv(self.mass_data_train_path)
         self.metadata_df = pd.read_csv(self.metadata_path)
+        # Subject ID -> full folder path, built once; the first location wins for repeated IDs
+        locations = self.metadata_df.drop_duplicates('Subject ID')
+        self._subject_to_location = {
+            subject_id: str(self.data_path / location)
+            for subject_id, location in zip(locations['Subject ID'], locations['File Location'])
+        }
         
     def patient_data_df_with_dicom_paths(self):
         """Returns an updated version of the main patient table (mass_data_train.df) but with the Windows local file 
         paths included. Each row now has a direct link to the image and ROI mask dicom file."""
 
         self.patient_data_df = self.mass_data_train_df.copy()
-        image_path_list = []
-        mask_path_list = []
+        # Top-level folder of each file, i.e. the metadata 'Subject ID', split once for all rows
+        image_folders = self.mass_data_train_df['image file path'].str.split('/', n=1).str[0]
+        mask_folders = self.mass_data_train_df['ROI mask file path'].str.split('/', n=1).str[0]
+        image_paths, mask_paths = self._path_to_dicoms(image_folders, mask_folders)
 
-        for patient_num in range(self.mass_data_train_df.shape[0]):
-            image_path, mask_path = self._path_to_dicoms(patient_num)
-            image_path_list.append(str(image_path))
-            mask_path_list.append(str(mask_path))
+        self.patient_data_df["global image dicom path"] = image_paths.to_numpy()
+        self.patient_data_df["global mask dicom path"] = mask_paths.to_numpy()
 
-        self.patient_data_df["global image dicom path"] = image_path_list
-        self.patient_data_df["global mask dicom path"] = mask_path_list
+        # Store the filter columns in upper case, as PatientDataFilterLogic matches them case-insensitively
+        for column_name in ['left or right breast', 'image view']:
+            self.patient_data_df[column_name] = self.patient_data_df[column_name].str.upper()
 
     def patient_data_sql(self):
         # --- 1. Choose the patient dataFrame to save to sql---
@@ -53,17 +63,43 @@ class DataIngestion:
         conn = sqlite3.connect(database_file_name)
 
         # --- 4. Write the DataFrame to the SQL database ---
-        # This is the key command
+        # The table is created with explicit column types and all rows go in with a single
+        # executemany() inside one transaction, instead of pandas' to_sql.
         try:
-            # 'name' is the name of the table we want to create
-            # 'con' is the connection object
-            # 'if_exists' tells pandas what to do if the table is already there
-            #   'replace': Drop the old table and create a new one
-            #   'append': Add data to the end of the existing table
-            #   'fail': (Default) Do nothing and raise an error
-            # 'index=False' means do not write the pandas index (0, 1, 2...) as a column
-
-            df.to_sql(name=table_name, con=conn, if_exists='replace', index=False)
+            # The database is rebuilt from the CSV files on every run, so skip fsync during the load
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+
+            column_definitions = ", ".join(
+                f'"{column}" {self._sqlite_type(dtype)}' for column, dtype in df.dtypes.items()
+            )
+            placeholders = ", ".join("?" for _ in df.columns)
+
+            conn.execute('BEGIN')
+            conn.execute(f'DROP TABLE IF EXISTS {table_name}')
+            conn.execute(f'CREATE TABLE {table_name} ({column_definitions})')
+            # Cast to object so sqlite3 receives plain Python values (NaN becomes NULL)
+            rows = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+            conn.executemany(f'INSERT INTO {table_name} VALUES ({placeholders})', rows)
+
+            # Index the columns the app filters on; patient_id leads, so it also serves
+            # lookups by patient_id alone. ANALYZE fills sqlite_stat1 for the query planner.
+            conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table_name}_pid_side_view '
+                         f'ON {table_name}(patient_id, "left or right breast", "image view")')
+
+            # Rebuild the distinct filter values with the table, so DatabaseHandler never
+            # serves the options of a previous ingest
+            conn.execute('DROP TABLE IF EXISTS ui_options')
+            conn.execute('CREATE TABLE ui_options (k TEXT, v)')
+            for column_name in UI_OPTION_COLUMNS:
+                conn.execute(
+                    f'INSERT INTO ui_options SELECT DISTINCT ?, "{column_name}" FROM {table_name} '
+                    f'WHERE "{column_name}" IS NOT NULL',
+                    (column_name,)
+                )
+            conn.execute('CREATE INDEX idx_ui_options_k ON ui_options(k)')
+            conn.execute('ANALYZE')
+            conn.commit()
 
             print(f"Success! DataFrame was written to table '{table_name}' in '{database_file_name}'")
 
@@ -94,22 +130,25 @@ class DataIngestion:
         finally:
             conn.close()
 
-    def _path_to_dicoms(self, patient_num):
-        """
+    @staticmethod
+    def _sqlite_type(dtype):
+        """Maps a pandas column dtype to the matching SQLite column type."""
+        if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+            return 'INTEGER'
+        if pd.api.types.is_float_dtype(dtype):
+            return 'REAL'
+        return 'TEXT'
 
-        :rtype: Windows path
+    def _path_to_dicoms(self, image_folders, mask_folders):
         """
-        image_folder_name = self.mass_data_train_df['image file path'][patient_num].split('/')[0]
-        mask_folder_name = self.mass_data_train_df['ROI mask file path'][patient_num].split('/')[0]
-        metadata_image_folder = self.metadata_df[self.metadata_df['Subject ID'] == image_folder_name]
-        metadata_mask_folder = self.metadata_df[self.metadata_df['Subject ID'] == mask_folder_name]
-        image_folder_path = metadata_image_folder['File Location'].values[0]
-        mask_folder_path = metadata_mask_folder['File Location'].values[0]
-        images_path = self.data_path / image_folder_path
-        mask_path = self.data_path / mask_folder_path
-
-        return images_path, mask_path
+        Resolves the image and ROI mask folder names of all rows at once, with a vectorized map
+        through _subject_to_location instead of scanning metadata_df.
 
+        :param image_folders: pandas Series with the top-level folder of each image file
+        :param mask_folders: pandas Series with the top-level folder of each ROI mask file
+        :rtype: tuple of pandas Series with the Windows paths (as str) of the image and mask folders
+        """
+        return image_folders.map(self._subject_to_location), mask_folders.map(self._subject_to_location)
 
 
 if __name__ == '__main__':
@@ -2,6 +2,9 @@ import streamlit as st
 from PatientDataFilterLogic import PatientDataFilterLogic
 from ImageProcessing import ImageProcessing
 import pandas as pd
+import io
+from PIL import Image
+from pathlib import Path
 
 # --- App Configuration ---
 st.set_page_config(layout="wide")
@@ -10,52 +13,83 @@ st.title("Breast Cancer Patient Data Viewer")
 # --- Initialization & Caching ---
 @st.cache_resource
 def init_logic():
+    # Builds the logic layer and loads and validates the filter options once per process, so
+    # reruns skip both. A failure raises, which is not cached, so the next rerun retries.
+    pdfl = PatientDataFilterLogic("clinical_database.db")
     try:
-        return PatientDataFilterLogic("clinical_database.db")
-    except Exception as e:
-        st.error(f"Fatal Error on startup: Could not initialize the application logic. {e}")
-        return None
-
-@st.cache_data
-def load_all_patient_ids(_pdfl):
-    try:
-        return _pdfl.get_all_patient_ids()
-    except Exception as e:
-        st.error(f"Fatal Error on startup: Could not load patient IDs. {e}")
-        return []
-
-pdfl = init_logic()
-if not pdfl:
-    st.stop()
-
-all_patient_ids = load_all_patient_ids(pdfl)
-if not all_patient_ids:
-    st.sidebar.error("Failed to load patient IDs from the database.")
+        ui_options = load_ui_options(pdfl, Path(pdfl.db_path).stat().st_mtime_ns)
+    except Exception:
+        pdfl.close()
+        raise
+    return pdfl, ui_options
+
+@st.cache_data(persist="disk", show_spinner=False)
+def load_ui_options(_pdfl, db_mtime_ns):
+    # Persisted across restarts; db_mtime_ns ties the stored copy to the current database file.
+    # Empty options raise instead of returning, so they are never written to the disk cache.
+    ui_options = _pdfl.get_ui_selection_options()
+    if not all(ui_options.values()):
+        raise ValueError("The database returned empty filter options.")
+    return ui_options
+
+# Long side of the browser preview; the column never shows the full-resolution image anyway
+PREVIEW_MAX_SIZE = 1024
+PREVIEW_JPEG_QUALITY = 85
+
+@st.cache_data(max_entries=32)
+def _render_dicom_preview(_pdfl, path_str, mtime_ns):
+    # mtime_ns (of the DICOM file, not its folder) is part of the cache key so a rewritten file is
+    # decoded again. The downsampled JPEG is cached rather than the image, so a cache hit only
+    # hands back a small byte string. Failures raise, so they are never cached.
+    pixel_array = _pdfl.get_patient_image_data(Path(path_str))
+    if pixel_array is None:
+        raise ValueError("Could not load the pixel data from the DICOM file.")
+    display_image = ImageProcessing.normalize_to_pil(pixel_array)
+    if display_image is None:
+        raise ValueError("Could not process the pixel data from the DICOM file.")
+    display_image.thumbnail((PREVIEW_MAX_SIZE, PREVIEW_MAX_SIZE), Image.Resampling.BILINEAR)
+    jpeg_buffer = io.BytesIO()
+    display_image.save(jpeg_buffer, format="JPEG", quality=PREVIEW_JPEG_QUALITY)
+    return jpeg_buffer.getvalue()
+
+@st.cache_data(max_entries=4096, show_spinner=False)
+def _path_exists(path_str):
+    # DICOM files rarely appear or disappear while the app is running, so one check per path is
+    # enough; the sidebar's "Refresh files" button clears it. A Streamlit cache is used because
+    # this script is re-executed on every rerun, which would reset a module-level lru_cache.
+    return Path(path_str).exists()
+
+@st.cache_data(max_entries=32)
+def _metadata_table(_pdfl, path_str, mtime_ns):
+    # Flattened to a two-column string table once per file, so reruns reuse the same Arrow payload
+    image_metadata, _ = _pdfl.get_dicom_metadata(Path(path_str))
+    return pd.DataFrame(list(image_metadata.items()), columns=["Tag", "Value"]).astype({"Value": "string"})
+
+try:
+    pdfl, ui_options = init_logic()
+except Exception as e:
+    st.error(f"Fatal Error on startup: Could not initialize the application logic or its filter options. {e}")
     st.stop()
+all_patient_ids = ui_options['patient_ids']
 
 # --- Sidebar ---
 st.sidebar.header("Select Patient Filters")
 
+if st.sidebar.button("Refresh files", help="Check again which DICOM files exist on disk."):
+    _path_exists.clear()
+
 selected_patient_id = st.sidebar.selectbox("Patient ID", options=all_patient_ids)
 
-if selected_patient_id:
-    patient_options = pdfl.get_dependent_options(selected_patient_id)
-    available_breast_sides = patient_options.get('breast_sides', [])
-else:
-    available_breast_sides = []
+option_tree = pdfl.get_patient_option_tree(selected_patient_id)
+available_breast_sides = list(option_tree)
 
 if not available_breast_sides:
     st.sidebar.warning("No data available for this patient.")
     selected_breast_side = None
-    available_image_views = []
 else:
     selected_breast_side = st.sidebar.selectbox("Breast Side", options=available_breast_sides)
 
-if selected_patient_id and selected_breast_side:
-    side_options = pdfl.get_dependent_options(selected_patient_id, breast_side=selected_breast_side)
-    available_image_views = side_options.get('image_views', [])
-else:
-    available_image_views = []
+available_image_views = option_tree.get(selected_breast_side, []) if selected_breast_side else []
 
 if not available_image_views:
     st.sidebar.warning("No image views available for this selection.")
@@ -65,81 +99,82 @@ else:
 
 
 # --- Main Content Area ---
-if all([selected_patient_id, selected_breast_side, selected_image_view]):
-    try:
-        presentation_df = pdfl.get_patient_filtered_data(selected_patient_id, selected_breast_side, selected_image_view)
+def _render_patient_view(selected_patient_id, selected_breast_side, selected_image_view):
+    # A view is only selected once a patient and a side are, so it alone tells if the trio is complete
+    if selected_image_view:
+        try:
+            selection = pdfl.get_patient_selection(selected_patient_id, selected_breast_side, selected_image_view)
         
-        if presentation_df.empty:
-            st.warning("No matching clinical data found for the selected filters.")
-        else:
-            st.header("Clinical Findings")
-            patient_record = presentation_df.iloc[0]
-
-            card_col1, card_col2, card_col3 = st.columns(3)
-            with card_col1:
-                st.metric(
-                    label="Pathology", 
-                    value=str(patient_record.get('pathology', 'N/A')),
-                    help="Final diagnosis. Options: BENIGN, BENIGN_WITHOUT_CALLBACK, MALIGNANT."
-                )
-            with card_col2:
-                st.metric(
-                    label="BI-RADS Assessment", 
-                    value=str(patient_record.get('assessment', 'N/A')),
-                    help="0: Incomplete, 1: Negative, 2: Benign, 3: Probably Benign, 4: Suspicious, 5: Highly Suspicious, 6: Known Malignancy."
-                )
-            with card_col3:
-                st.metric(
-                    label="Breast Density", 
-                    value=str(patient_record.get('breast_density', 'N/A')),
-                    help="A score from 1 to 4. 1: Mostly fatty, 2: Scattered density, 3: Heterogeneously dense, 4: Extremely dense."
-                )
-
-            st.divider()
-
-            detail_col1, detail_col2, detail_col3 = st.columns(3)
-            with detail_col1:
-                st.metric(
-                    label="Mass Shape",
-                    value=str(patient_record.get('mass shape', 'N/A')),
-                    help="Shape of the mass. Options: ROUND, OVAL, LOBULATED, IRREGULAR, etc."
-                )
-            with detail_col2:
-                st.metric(
-                    label="Mass Margins",
-                    value=str(patient_record.get('mass margins', 'N/A')),
-                    help="Edge characteristics. Options: CIRCUMSCRIBED, OBSCURED, MICROLOBULATED, ILL_DEFINED, SPICULATED."
-                )
-            with detail_col3:
-                st.metric(
-                    label="Subtlety Score",
-                    value=str(patient_record.get('subtlety', 'N/A')),
-                    help="Subjective rating of detection difficulty from 1 (subtle) to 5 (obvious)."
-                )
-
-            st.header("DICOM Image")
-            dcm_path = pdfl.get_patient_dicom_path(selected_patient_id, selected_breast_side, selected_image_view)
-            
-            if not dcm_path.exists():
-                st.error(f"DICOM path not found or is invalid: {dcm_path}")
+            if not selection:
+                st.warning("No matching clinical data found for the selected filters.")
             else:
-                pixel_array, _ = pdfl.get_patient_image_data(dcm_path)
-                
-                if pixel_array is not None:
-                    display_image = ImageProcessing.normalize_to_pil(pixel_array)
-                    if display_image:
-                        st.image(display_image, caption=f"DICOM Image for {selected_patient_id}", width='stretch')
-                    else:
-                        st.error("Could not process the image for display.")
+                patient_record = selection.record
+                st.header("Clinical Findings")
+
+                card_col1, card_col2, card_col3 = st.columns(3)
+                with card_col1:
+                    st.metric(
+                        label="Pathology", 
+                        value=str(patient_record.get('pathology', 'N/A')),
+                        help="Final diagnosis. Options: BENIGN, BENIGN_WITHOUT_CALLBACK, MALIGNANT."
+                    )
+                with card_col2:
+                    st.metric(
+                        label="BI-RADS Assessment", 
+                        value=str(patient_record.get('assessment', 'N/A')),
+                        help="0: Incomplete, 1: Negative, 2: Benign, 3: Probably Benign, 4: Suspicious, 5: Highly Suspicious, 6: Known Malignancy."
+                    )
+                with card_col3:
+                    st.metric(
+                        label="Breast Density", 
+                        value=str(patient_record.get('breast_density', 'N/A')),
+                        help="A score from 1 to 4. 1: Mostly fatty, 2: Scattered density, 3: Heterogeneously dense, 4: Extremely dense."
+                    )
+
+                st.divider()
+
+                detail_col1, detail_col2, detail_col3 = st.columns(3)
+                with detail_col1:
+                    st.metric(
+                        label="Mass Shape",
+                        value=str(patient_record.get('mass shape', 'N/A')),
+                        help="Shape of the mass. Options: ROUND, OVAL, LOBULATED, IRREGULAR, etc."
+                    )
+                with detail_col2:
+                    st.metric(
+                        label="Mass Margins",
+                        value=str(patient_record.get('mass margins', 'N/A')),
+                        help="Edge characteristics. Options: CIRCUMSCRIBED, OBSCURED, MICROLOBULATED, ILL_DEFINED, SPICULATED."
+                    )
+                with detail_col3:
+                    st.metric(
+                        label="Subtlety Score",
+                        value=str(patient_record.get('subtlety', 'N/A')),
+                        help="Subjective rating of detection difficulty from 1 (subtle) to 5 (obvious)."
+                    )
+
+                st.header("DICOM Image")
+                dcm_path = selection.dicom_path
+            
+                if not dcm_path or not _path_exists(dcm_path):
+                    st.error(f"DICOM path not found or is invalid: {dcm_path}")
                 else:
-                    st.error("Could not load pixel data from the DICOM file.")
+                    dcm_mtime_ns = pdfl.get_dicom_mtime_ns(dcm_path)
+                    display_preview = _render_dicom_preview(pdfl, dcm_path, dcm_mtime_ns)
+                    st.image(display_preview, caption=f"DICOM Image for {selected_patient_id}", width='stretch')
 
-    except (ValueError, FileNotFoundError) as e:
-        st.error(f"Data Retrieval Error: {e}")
-    except Exception as e:
-        st.error(f"An unexpected error occurred: {e}")
-else:
-    st.info("Select patient filters from the sidebar to automatically display data.")
+                    with st.expander("DICOM Metadata"):
+                        st.dataframe(_metadata_table(pdfl, dcm_path, dcm_mtime_ns), hide_index=True, width='stretch')
+
+        except (ValueError, FileNotFoundError) as e:
+            st.error(f"Data Retrieval Error: {e}")
+        except Exception as e:
+            st.error(f"An unexpected error occurred: {e}")
+    else:
+        st.info("Select patient filters from the sidebar to automatically display data.")
+
+
+_render_patient_view(selected_patient_id, selected_breast_side, selected_image_view)
 
 # --- NEW: Learn More Section ---
 st.divider()
@@ -0,0 +1,58 @@
+import numpy as np
+import pydicom
+import pytest
+from pydicom.dataset import FileDataset, FileMetaDataset
+from DicomHandler import DicomHandler
+
+ROWS, COLUMNS = 4, 5
+
+def _write_dicom(folder, pixels, bits_stored, signed=False):
+    """
+    Writes a single-frame, uncompressed little-endian DICOM file with the raw 'pixels' to
+    'folder' and returns the folder, as DicomHandler expects.
+    """
+    file_meta = FileMetaDataset()
+    file_meta.MediaStorageSOPClassUID = pydicom.uid.SecondaryCaptureImageStorage
+    file_meta.MediaStorageSOPInstanceUID = pydicom.uid.generate_uid()
+    file_meta.TransferSyntaxUID = pydicom.uid.ExplicitVRLittleEndian
+
+    dataset = FileDataset(str(folder / 'image.dcm'), {}, file_meta=file_meta, preamble=b'\0' * 128)
+    dataset.SOPClassUID = file_meta.MediaStorageSOPClassUID
+    dataset.SOPInstanceUID = file_meta.MediaStorageSOPInstanceUID
+    dataset.Modality = 'MG'
+    dataset.Rows, dataset.Columns = pixels.shape
+    dataset.SamplesPerPixel = 1
+    dataset.PhotometricInterpretation = 'MONOCHROME2'
+    dataset.BitsAllocated = pixels.dtype.itemsize * 8
+    dataset.BitsStored = bits_stored
+    dataset.HighBit = bits_stored - 1
+    dataset.PixelRepresentation = 1 if signed else 0
+    dataset.PixelData = pixels.astype(pixels.dtype.newbyteorder('<')).tobytes()
+    dataset.save_as(folder / 'image.dcm', enforce_file_format=True)
+    return folder
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.uint16, np.int16])
+def test_full_width_pixels_are_memory_mapped(tmp_path, dtype):
+    info = np.iinfo(dtype)
+    pixels = np.linspace(info.min, info.max, ROWS * COLUMNS).astype(dtype).reshape(ROWS, COLUMNS)
+    dh = DicomHandler(_write_dicom(tmp_path, pixels, info.bits, signed=info.min < 0))
+
+    pixel_array = dh.get_pixel_array()
+
+    assert isinstance(pixel_array, np.memmap)
+    np.testing.assert_array_equal(pixel_array, dh.dataset.pixel_array)
+
+@pytest.mark.parametrize("signed", [False, True])
+def test_unused_high_bits_fall_back_to_pydicom(tmp_path, signed):
+    # 12 bits stored in 16, with garbage set in the unused high bits
+    values = np.arange(ROWS * COLUMNS, dtype=np.uint16).reshape(ROWS, COLUMNS) * 100
+    raw = values | np.uint16(0xF000)
+    pixels = raw.view(np.int16) if signed else raw
+    dh = DicomHandler(_write_dicom(tmp_path, pixels, bits_stored=12, signed=signed))
+
+    pixel_array = dh.get_pixel_array()
+
+    assert not isinstance(pixel_array, np.memmap)
+    np.testing.assert_array_equal(pixel_array, dh.dataset.pixel_array)
+    if not signed:
+        np.testing.assert_array_equal(pixel_array, values)
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from ImageProcessing import ImageProcessing
+
+SHAPE = (64, 48)
+
+def _reference_normalize(pixel_array):
+    """The original float64 rescale to 0-255 that normalize_to_pil has to reproduce."""
+    pixel_array_float = pixel_array.astype(float)
+    min_val, max_val = pixel_array_float.min(), pixel_array_float.max()
+    if max_val <= min_val:
+        return np.zeros(pixel_array.shape, dtype=np.uint8)
+    return ((pixel_array_float - min_val) / (max_val - min_val) * 255.0).astype(np.uint8)
+
+def _random_pixels(dtype, low=None, high=None, seed=0):
+    """Random pixels over the dtype's full range, or over [low, high] if given."""
+    dtype = np.dtype(dtype)
+    info = np.iinfo(dtype)
+    low = info.min if low is None else low
+    high = info.max if high is None else high
+    pixels = np.random.default_rng(seed).integers(low, high, size=SHAPE, endpoint=True)
+    return pixels.astype(dtype)
+
+@pytest.mark.parametrize("dtype", ["<u1", "<u2", "<i1", "<i2", ">u2", ">i2"])
+def test_integer_lookup_table_matches_reference(dtype):
+    pixel_array = _random_pixels(dtype)
+    np.testing.assert_array_equal(np.asarray(ImageProcessing.normalize_to_pil(pixel_array)),
+                                  _reference_normalize(pixel_array))
+
+@pytest.mark.parametrize("dtype,low,high", [("<u2", 100, 4095), ("<i2", -1200, 900), ("<i1", -5, 3)])
+def test_integer_partial_range_matches_reference(dtype, low, high):
+    # The table is cached per (dtype, min, max), so ranges other than the full dtype are covered too
+    pixel_array = _random_pixels(dtype, low, high, seed=1)
+    np.testing.assert_array_equal(np.asarray(ImageProcessing.normalize_to_pil(pixel_array)),
+                                  _reference_normalize(pixel_array))
+
+@pytest.mark.parametrize("dtype", ["<u1", "<i2", "<f4"])
+def test_flat_image_is_black(dtype):
+    pixel_array = np.full(SHAPE, 7, dtype=dtype)
+    image = np.asarray(ImageProcessing.normalize_to_pil(pixel_array))
+    assert image.dtype == np.uint8 and image.shape == SHAPE and not image.any()
+
+@pytest.mark.parametrize("pixel_array", [
+    np.random.default_rng(2).normal(0.0, 1.0, SHAPE).astype(np.float32),
+    np.random.default_rng(3).uniform(-1e4, 1e4, SHAPE),
+    _random_pixels("<i4", 1_000_000_000, 1_000_004_095, seed=4),
+])
+def test_float_and_wide_integer_match_reference(pixel_array):
+    # The float32 path may round an exact boundary value down by one level
+    image = np.asarray(ImageProcessing.normalize_to_pil(pixel_array)).astype(np.int16)
+    assert np.abs(image - _reference_normalize(pixel_array)).max() <= 1
+
+def test_bool_image_is_black_and_white():
+    pixel_array = np.random.default_rng(5).random(SHAPE) > 0.5
+    np.testing.assert_array_equal(np.asarray(ImageProcessing.normalize_to_pil(pixel_array)),
+                                  _reference_normalize(pixel_array))
+
+def test_none_returns_none():
+    assert ImageProcessing.normalize_to_pil(None) is None
@@ -1,86 +1,142 @@
+import random
 import sqlite3
-from PatientDataFilterLogic import PatientDataFilterLogic
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from functools import lru_cache
 from pathlib import Path
-import pandas as pd
+import pytest
+from PatientDataFilterLogic import PatientDataFilterLogic, PRESENTATION_COLUMNS, SELECTION_COLUMNS
 
-def get_test_patient_ids(db_path, count=3):
-    """Connects to the database and fetches a few unique patient IDs for testing."""
+# Resolved next to this file, so the tests do not depend on the directory pytest is started from
+DB_FILE = Path(__file__).resolve().parent / "clinical_database.db"
+
+# A couple of common (breast side, image view) combinations tested for every sampled patient
+SIDE_VIEW_COMBINATIONS = [("LEFT", "CC"), ("RIGHT", "MLO")]
+
+# Fixed seed, so every run and every pytest-xdist worker collects the same patients
+SAMPLE_SEED = 42
+
+@lru_cache(maxsize=4096)
+def _path_exists(path_str):
+    """Checks each DICOM path on disk once per run."""
+    return Path(path_str).exists()
+
+def _connect_read_only(db_path):
+    """Opens the database read-only, so a missing file raises instead of being created empty."""
+    return closing(sqlite3.connect(f"{Path(db_path).as_uri()}?mode=ro", uri=True))
+
+def get_test_patient_ids(db_path, count=3, seed=SAMPLE_SEED):
+    """
+    Fetches a seeded sample of unique patient IDs for testing. The IDs are read in sorted order
+    (the GROUP BY walks the (patient_id, side, view) index that DataIngestion creates), so the
+    sample, and with it the collected test IDs, is the same on every run. The connection is
+    closed before returning.
+    """
     try:
-        with sqlite3.connect(db_path) as con:
-            cursor = con.cursor()
-            cursor.execute("SELECT DISTINCT patient_id FROM patients LIMIT ?", (count,))
-            ids = [row[0] for row in cursor.fetchall()]
-            return ids
+        with _connect_read_only(db_path) as con:
+            cursor = con.execute("SELECT patient_id FROM patients GROUP BY patient_id ORDER BY patient_id")
+            all_ids = [row[0] for row in cursor]
     except sqlite3.Error as e:
         print(f"Database error: {e}")
         return []
+    return random.Random(seed).sample(all_ids, min(count, len(all_ids)))
 
-def run_test_for_patient(pdfl, patient_id, breast_side, image_view):
-    """Runs a single test case for a given patient and filter combination."""
-    print(f"--- Testing Patient ID: {patient_id}, Side: {breast_side}, View: {image_view} ---")
+def dicom_data_available(db_path, patient_ids):
+    """Checks whether any DICOM folder of the sampled patients is on this machine."""
+    if not patient_ids:
+        return False
+    placeholders = ", ".join("?" for _ in patient_ids)
     try:
-        # 1. Get filtered data as a DataFrame
-        filtered_df = pdfl.get_patient_filtered_data(patient_id, breast_side, image_view)
-        if filtered_df.empty:
-            print("Result: SKIPPED - No data found for the specified filters.\n")
-            return True  # Not a failure, just no data to test
-
-        print("Result: SUCCESS - Filtered data found.")
-
-        # 2. Get the DICOM path
-        dcm_path = pdfl.get_patient_dicom_path(filtered_df)
-        if not dcm_path.exists():
-            print(f"Result: FAILED - DICOM path does not exist: {dcm_path}\n")
-            return False
-
-        print(f"Result: SUCCESS - DICOM path found: {dcm_path}")
-
-        # 3. Get image data and the new pixel_spacing value
-        image_data_tuple = pdfl.get_patient_image_data(dcm_path)
-        
-        # --- NEW: Verify the return tuple and pixel_spacing ---
-        if len(image_data_tuple) != 3:
-            print(f"Result: FAILED - Expected 3 return values from get_patient_image_data, but got {len(image_data_tuple)}.\n")
-            return False
-        
-        pixel_array, image_metadata, pixel_spacing = image_data_tuple
-        
-        if pixel_array is None:
-            print("Result: FAILED - Could not extract pixel array from DICOM file.\n")
-            return False
-            
-        if not isinstance(pixel_spacing, list) or len(pixel_spacing) != 2 or not all(isinstance(x, float) for x in pixel_spacing):
-            print(f"Result: FAILED - Pixel spacing is not a list of two floats. Got: {pixel_spacing}\n")
-            return False
-
-        print(f"Result: SUCCESS - Pixel spacing extracted successfully: {pixel_spacing}\n")
-        return True
-
-    except Exception as e:
-        print(f"Result: FAILED - An unexpected error occurred: {e}\n")
+        with _connect_read_only(db_path) as con:
+            cursor = con.execute(
+                f'SELECT "global image dicom path" FROM patients WHERE patient_id IN ({placeholders})', patient_ids
+            )
+            return any(row[0] and _path_exists(row[0]) for row in cursor)
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
         return False
 
-if __name__ == "__main__":
-    db_file = "clinical_database.db"
-    
-    patient_ids_to_test = get_test_patient_ids(db_file, count=3)
-    
-    if not patient_ids_to_test:
-        print("Could not retrieve patient IDs for testing. Aborting.")
-    else:
-        print(f"Retrieved Patient IDs for testing: {patient_ids_to_test}\n")
-        
-        pdfl = PatientDataFilterLogic(db_file)
-        
-        success_count = 0
-        total_tests = 0
-        
-        for pid in patient_ids_to_test:
-            # Test a couple of common combinations
-            for side, view in [("LEFT", "CC"), ("RIGHT", "MLO")]:
-                total_tests += 1
-                if run_test_for_patient(pdfl, pid, side, view):
-                    success_count += 1
-        
-        print(f"\n--- Test Summary ---")
-        print(f"{success_count} out of {total_tests} tests passed.")
+PATIENT_IDS = get_test_patient_ids(DB_FILE, count=3)
+
+# The CBIS-DDSM images are not part of the repository. Tests reading them are skipped as a whole
+# when none of the sampled folders is on this machine; a single missing folder fails.
+requires_dicom_data = pytest.mark.skipif(
+    not dicom_data_available(DB_FILE, PATIENT_IDS), reason="The CBIS-DDSM DICOM folders are not on this machine."
+)
+
+@pytest.fixture(scope="session")
+def pdfl():
+    """One PatientDataFilterLogic, and so one connection and in-memory table, for the whole session."""
+    logic = PatientDataFilterLogic(str(DB_FILE))
+    yield logic
+    logic.close()
+
+@pytest.fixture(scope="session")
+def rows_by_selection(pdfl):
+    """Filtered rows of every tested selection, fetched with one batched call and grouped per selection."""
+    selections = [(pid, side, view) for pid in PATIENT_IDS for side, view in SIDE_VIEW_COMBINATIONS]
+    batch_df = pdfl.get_patient_filtered_data_batch(selections)
+    return dict(list(batch_df.groupby(list(SELECTION_COLUMNS), observed=True)))
+
+def _load_dicom_data(pdfl, dcm_path):
+    """Reads the metadata and pixel_spacing from a header-only read, then the pixel data."""
+    image_metadata, pixel_spacing = pdfl.get_dicom_metadata(dcm_path)
+    return image_metadata, pixel_spacing, pdfl.get_patient_image_data(dcm_path)
+
+@pytest.fixture(scope="session")
+def dicom_data(pdfl):
+    """
+    DICOM data of every tested selection with a DICOM path, read on a thread pool so the file
+    reads overlap. Maps each selection to its future; a failed read is raised by the test that
+    calls .result() instead of erroring the whole session.
+    """
+    selections = [(pid, side, view) for pid in PATIENT_IDS for side, view in SIDE_VIEW_COMBINATIONS]
+    dcm_paths = {selection: pdfl.get_dicom_path_scalar(*selection) for selection in selections}
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        return {
+            selection: executor.submit(_load_dicom_data, pdfl, dcm_path)
+            for selection, dcm_path in dcm_paths.items()
+            if dcm_path is not None
+        }
+
+def test_patient_ids_sampled():
+    assert PATIENT_IDS, "Could not retrieve patient IDs for testing."
+
+@pytest.mark.parametrize("patient_id", PATIENT_IDS)
+def test_patient_selections(pdfl, patient_id):
+    # Every side and view offered for a patient resolves to a record, rows and a DICOM path
+    option_tree = pdfl.get_patient_option_tree(patient_id)
+    assert option_tree, "Sampled patient has no breast side / image view options."
+
+    selections = [(patient_id, side, view) for side, views in option_tree.items() for view in views]
+    batch_df = pdfl.get_patient_filtered_data_batch(selections)
+    batched_selections = set(zip(*(batch_df[column].astype(object) for column in SELECTION_COLUMNS)))
+    for selection in selections:
+        patient_selection = pdfl.get_patient_selection(*selection)
+        assert patient_selection is not None, f"No record for offered selection {selection}."
+        assert set(patient_selection.record) == set(PRESENTATION_COLUMNS)
+        assert patient_selection.dicom_path, f"No DICOM path for offered selection {selection}."
+        assert pdfl.get_dicom_path_scalar(*selection) == Path(patient_selection.dicom_path)
+        assert selection in batched_selections, f"No batched rows for {selection}."
+
+@requires_dicom_data
+@pytest.mark.parametrize("patient_id", PATIENT_IDS)
+@pytest.mark.parametrize("breast_side,image_view", SIDE_VIEW_COMBINATIONS)
+def test_patient(pdfl, rows_by_selection, dicom_data, patient_id, breast_side, image_view):
+    # 1. Check the filtered data fetched for this selection
+    filtered_df = rows_by_selection.get((patient_id, breast_side, image_view))
+    if filtered_df is None or filtered_df.empty:
+        pytest.skip("No data found for the specified filters.")
+
+    # 2. Get the DICOM path
+    dcm_path = pdfl.get_dicom_path_scalar(patient_id, breast_side, image_view)
+    assert dcm_path is not None, "Filtered data found but no DICOM path."
+    assert _path_exists(str(dcm_path)), f"DICOM folder is missing: {dcm_path}"
+
+    # 3. Get the metadata, pixel_spacing and pixel data prefetched on the thread pool
+    image_metadata, pixel_spacing, pixel_array = dicom_data[(patient_id, breast_side, image_view)].result()
+
+    assert pixel_array is not None, "Could not extract pixel array from DICOM file."
+    assert isinstance(pixel_spacing, list) and len(pixel_spacing) == 2 \
+        and all(isinstance(x, float) for x in pixel_spacing), \
+        f"Pixel spacing is not a list of two floats. Got: {pixel_spacing}"